@@ -4,12 +4,152 @@ Contains abstract functionality for learning locally linear sparse model.
 import numpy as np
 import scipy as sp
 import sklearn
+from joblib import Parallel, delayed
+from sklearn.base import clone
 from sklearn.linear_model import Ridge
 from slime_lm._least_angle import lars_path
 from sklearn.utils import check_random_state
-from scipy.stats import entropy     #Khoa add
 from scipy.spatial.distance import hamming  #Khoa add
-import random   #Khoa add
+from scipy.linalg.blas import get_blas_funcs
+from scipy.linalg.lapack import get_lapack_funcs
+
+
+def _bootstrap_ridge_coefs(X, y, n_iter, alpha=1., random_state=None):
+    """Fits Ridge (with intercept) on n_iter bootstrap resamples of (X, y).
+
+    A bootstrap resample is the same as weighting every row by the number of
+    times it was drawn, so each fit reduces to one weighted Gram matrix and
+    one F x F solve instead of an sklearn fit on a fancy-indexed copy.
+
+    Computations are carried out in the floating point dtype of X.
+
+    Returns:
+        array of shape (n_iter, X.shape[1]) with one row of coefficients
+        per bootstrap resample.
+    """
+    random_state = check_random_state(random_state)
+    n_samples, n_features = X.shape
+    penalty = alpha * np.eye(n_features, dtype=X.dtype)
+    coefs = np.zeros((n_iter, n_features), dtype=X.dtype)
+    for i in range(n_iter):
+        boots_sample_idx = random_state.randint(0, n_samples, size=n_samples)
+        counts = np.bincount(boots_sample_idx, minlength=n_samples).astype(X.dtype)
+        x_mean = np.dot(counts, X) / n_samples
+        y_mean = np.dot(counts, y) / n_samples
+        x_weighted = X.T * counts
+        gram = np.dot(x_weighted, X) - n_samples * np.outer(x_mean, x_mean)
+        xty = np.dot(x_weighted, y) - n_samples * x_mean * y_mean
+        coefs[i] = np.linalg.solve(gram + penalty, xty)
+    return coefs
+
+
+def _sign_entropy(coefs):
+    """Base-2 entropy of the distribution of signs in each column of coefs."""
+    signs = np.sign(coefs)
+    counts = np.array([np.count_nonzero(signs == sign, axis=0)
+                       for sign in (-1, 0, 1)])
+    probabilities = counts / coefs.shape[0]
+    log_probabilities = np.log2(probabilities, where=probabilities > 0,
+                                out=np.zeros_like(probabilities))
+    return -(probabilities * log_probabilities).sum(axis=0)
+
+
+def _as_fortran(data):
+    """Column-major version of dense data; sparse data is returned as is.
+
+    Feature selection mostly works column by column, which is stride-1 in
+    Fortran order. Already Fortran-ordered data is not copied.
+    """
+    if sp.sparse.issparse(data):
+        return data
+    return np.asfortranarray(data)
+
+
+def _weighted_center_scale(data, weights, sqrt_weights=None):
+    """Returns (data - weighted mean) * sqrt(weights), row-wise.
+
+    The weighted mean is taken without a weighted copy of data, and the
+    subtraction and scaling write into a single output array.
+    """
+    if sqrt_weights is None:
+        sqrt_weights = np.sqrt(weights)
+    mean = np.einsum('i,i...->...', weights, data) / weights.sum()
+    out = np.empty_like(data, dtype=mean.dtype)
+    np.subtract(data, mean, out=out)
+    scale = sqrt_weights if out.ndim == 1 else sqrt_weights[:, np.newaxis]
+    np.multiply(out, scale, out=out)
+    return out
+
+
+def _gram(X):
+    """X.T @ X through a BLAS symmetric rank-k update, which only computes
+    one triangle, i.e. half the flops of the equivalent GEMM."""
+    syrk = get_blas_funcs('syrk', (X,))
+    if X.flags.f_contiguous:
+        gram = syrk(1., X, trans=1)
+    else:
+        # X.T is then Fortran-contiguous, so neither call copies X
+        gram = syrk(1., X.T, trans=0)
+    return np.triu(gram) + np.triu(gram, 1).T
+
+
+def _well_conditioned(gram, max_cond=1e4):
+    """Whether the symmetric positive semi-definite gram has a 1-norm
+    condition number below max_cond.
+
+    Uses a Cholesky factorization and the LAPACK pocon estimate instead of
+    the full SVD behind np.linalg.cond. A failed factorization means gram
+    is (numerically) singular.
+    """
+    potrf, pocon = get_lapack_funcs(('potrf', 'pocon'), (gram,))
+    chol, info = potrf(gram, lower=False)
+    if info != 0:
+        return False
+    rcond, info = pocon(chol, np.abs(gram).sum(axis=0).max())
+    return info == 0 and rcond * max_cond > 1.
+
+
+def _weighted_gram(data, weights, sqrt_weights=None):
+    """Centers and kernel-weights data for the (non-testing) lasso path.
+
+    That lasso path is only used to pick features, so when the Gram matrix
+    is well conditioned both are returned in float32, which halves the
+    memory traffic of lars_path.
+
+    Returns:
+        (weighted_data, gram), where gram is weighted_data.T @ weighted_data
+    """
+    weighted_data = _weighted_center_scale(data, weights, sqrt_weights)
+    gram = _gram(weighted_data)
+    if _well_conditioned(gram):
+        weighted_data = weighted_data.astype(np.float32)
+        gram = gram.astype(np.float32)
+    return weighted_data, gram
+
+
+def _lars_path_features(coefs, num_features):
+    """Nonzero features of the last step of a lars path (excluding the empty
+    first step) that has at most num_features nonzero coefficients. Falls
+    back to the second step if no step is sparse enough."""
+    if coefs.shape[1] < 2:
+        return np.arange(coefs.shape[0])
+    n_nonzero = np.count_nonzero(coefs[:, 1:], axis=0)
+    sparse_enough = np.flatnonzero(n_nonzero <= num_features)
+    step = sparse_enough[-1] + 1 if len(sparse_enough) else 1
+    return np.flatnonzero(coefs[:, step])
+
+
+def _top_abs_indices(values, k):
+    """Indices of the k entries of values with largest absolute value, sorted
+    by decreasing absolute value."""
+    abs_values = np.abs(values)
+    if k <= 0:
+        return np.zeros(0, dtype=np.intp)
+    if k < len(abs_values):
+        top = np.argpartition(-abs_values, k - 1)[:k]
+    else:
+        top = np.arange(len(abs_values))
+    return top[np.argsort(-abs_values[top], kind='stable')]
 
 
 class LimeBase(object):
@@ -33,120 +173,166 @@ class LimeBase(object):
         self.random_state = check_random_state(random_state)
 
     @staticmethod
-    def generate_lars_path(weighted_data, weighted_labels, testing=False, alpha=0.05):
+    def generate_lars_path(weighted_data, weighted_labels, testing=False, alpha=0.05,
+                           Gram=None, Xy=None, max_iter=500, fit_path=True,
+                           eps=np.finfo(float).eps):
         """Generates the lars path for weighted data.
 
         Args:
             weighted_data: data that has been weighted by kernel
             weighted_label: labels, weighted by kernel
+            Gram: optional precomputed weighted_data.T @ weighted_data
+            Xy: optional precomputed weighted_data.T @ weighted_labels
+            max_iter: maximum number of lars steps. Ignored when testing.
+            fit_path: if False, only the coefficients of the last step are
+                kept instead of the whole path. Ignored when testing.
+            eps: machine precision regularization of the Cholesky diagonal,
+                should match the dtype of the data.
 
         Returns:
             (alphas, coefs), both are arrays corresponding to the
-            regularization parameter and coefficients, respectively
+            regularization parameter and coefficients, respectively.
+            If fit_path is False these are those of the last step only.
         """
         x_vector = weighted_data
+        # lars_path only swaps columns of X when it has no Gram matrix, while
+        # it always swaps rows/columns of Gram, which may be shared by labels.
+        copy_X = Gram is None
         if not testing:
             alphas, _, coefs = lars_path(x_vector,
                                          weighted_labels,
+                                         Xy=Xy,
+                                         Gram=Gram,
+                                         max_iter=max_iter,
                                          method='lasso',
+                                         copy_X=copy_X,
+                                         copy_Gram=True,
+                                         eps=eps,
                                          verbose=False,
+                                         return_path=fit_path,
                                          alpha=alpha)
             return alphas, coefs
         else:
             alphas, _, coefs, test_result = lars_path(x_vector,
                                                            weighted_labels,
+                                                           Xy=Xy,
+                                                           Gram=Gram,
                                                            method='lasso',
+                                                           copy_X=copy_X,
+                                                           copy_Gram=True,
+                                                           eps=eps,
                                                            verbose=False,
                                                            testing=testing)
             return alphas, coefs, test_result   
 
     def forward_selection(self, data, labels, weights, num_features):
-        """Iteratively adds features to the model"""
-        clf = Ridge(alpha=0, fit_intercept=True, random_state=self.random_state)
+        """Iteratively adds features to the model.
+
+        Equivalent to greedily refitting an unregularized weighted linear
+        model (with intercept) for every candidate feature, but scores all
+        candidates of a step at once from the weighted Gram matrix: the gain
+        in explained sum of squares of adding feature j to the used set S is
+        (Xty[j] - G[j, S] beta) ** 2 / (G[j, j] - v.T v), with
+        v = L^-1 G[S, j] and L the Cholesky factor of G[S, S]."""
+        if sp.sparse.issparse(data):
+            # centering makes the weighted data dense anyway
+            data = data.toarray()
+        sqrt_weights = np.sqrt(weights)
+        weighted_data = _weighted_center_scale(data, weights, sqrt_weights)
+        weighted_labels = _weighted_center_scale(labels, weights, sqrt_weights)
+        gram = _gram(weighted_data)
+        xty = np.dot(weighted_data.T, weighted_labels)
+        gram_diag = np.diag(gram).copy()
+        tol = np.finfo(gram.dtype).eps * max(gram_diag.max(initial=0), 1.) * data.shape[0]
+
+        n_features = data.shape[1]
+        # Rows of v_rows are L^-1 G[S, :], with the columns at S forming L.T;
+        # z is L^-1 Xty[S].  Both grow by one row per (independent) feature.
+        v_rows = np.empty((0, n_features))
+        z = np.empty(0)
+        available = np.ones(n_features, dtype=bool)
         used_features = []
-        for _ in range(min(num_features, data.shape[1])):
-            max_ = -100000000
-            best = 0
-            for feature in range(data.shape[1]):
-                if feature in used_features:
-                    continue
-                clf.fit(data[:, used_features + [feature]], labels,
-                        sample_weight=weights)
-                score = clf.score(data[:, used_features + [feature]],
-                                  labels,
-                                  sample_weight=weights)
-                if score > max_:
-                    best = feature
-                    max_ = score
+        for _ in range(min(num_features, n_features)):
+            residual = gram_diag - np.einsum('ij,ij->j', v_rows, v_rows)
+            numerator = xty - np.dot(v_rows.T, z)
+            independent = residual > tol
+            gains = np.zeros(n_features)
+            gains[independent] = (numerator[independent] ** 2
+                                  / residual[independent])
+            gains[~available] = -np.inf
+            best = int(np.argmax(gains))
             used_features.append(best)
+            available[best] = False
+            if independent[best]:
+                # rank-1 extension of the Cholesky factor of G[S, S]
+                d = np.sqrt(residual[best])
+                new_row = (gram[best] - np.dot(v_rows[:, best], v_rows)) / d
+                v_rows = np.vstack((v_rows, new_row))
+                z = np.append(z, numerator[best] / d)
         return np.array(used_features)
 
-    def feature_selection(self, data, labels, weights, num_features, method, testing=False, alpha=0.05, use_stratification=True):
+    def feature_selection(self, data, labels, weights, num_features, method, testing=False, alpha=0.05, use_stratification=True,
+                          sqrt_weights=None, coef=None, weighted_gram=None):
         """Selects features for the model. see explain_instance_with_data to
-           understand the parameters."""
+           understand the parameters. sqrt_weights optionally holds the
+           precomputed np.sqrt(weights)."""
         if method == 'none':
-            return np.array(range(data.shape[1]))
+            return np.arange(data.shape[1])
         elif method == 'forward_selection':
             return self.forward_selection(data, labels, weights, num_features)
         elif method == 'highest_weights':
-            clf = Ridge(alpha=0.01, fit_intercept=True,
-                        random_state=self.random_state)
-            clf.fit(data, labels, sample_weight=weights)
+            if coef is None:
+                clf = Ridge(alpha=0.01, fit_intercept=True,
+                            random_state=self.random_state)
+                clf.fit(data, labels, sample_weight=weights)
+                coef = clf.coef_
 
-            coef = clf.coef_
             if sp.sparse.issparse(data):
-                coef = sp.sparse.csr_matrix(clf.coef_)
+                coef = sp.sparse.csr_matrix(coef)
                 weighted_data = coef.multiply(data[0])
                 # Note: most efficient to slice the data before reversing
                 sdata = len(weighted_data.data)
-                argsort_data = np.abs(weighted_data.data).argsort()
                 # Edge case where data is more sparse than requested number of feature importances
                 # In that case, we just pad with zero-valued features
                 if sdata < num_features:
-                    nnz_indexes = argsort_data[::-1]
+                    nnz_indexes = _top_abs_indices(weighted_data.data, sdata)
                     indices = weighted_data.indices[nnz_indexes]
                     num_to_pad = num_features - sdata
-                    indices = np.concatenate((indices, np.zeros(num_to_pad, dtype=indices.dtype)))
-                    indices_set = set(indices)
-                    pad_counter = 0
-                    for i in range(data.shape[1]):
-                        if i not in indices_set:
-                            indices[pad_counter + sdata] = i
-                            pad_counter += 1
-                            if pad_counter >= num_to_pad:
-                                break
+                    unused = np.ones(data.shape[1], dtype=bool)
+                    unused[indices] = False
+                    pad = np.flatnonzero(unused)[:num_to_pad].astype(indices.dtype)
+                    indices = np.concatenate((indices, pad))
                 else:
-                    nnz_indexes = argsort_data[sdata - num_features:sdata][::-1]
+                    nnz_indexes = _top_abs_indices(weighted_data.data, num_features)
                     indices = weighted_data.indices[nnz_indexes]
                 return indices
             else:
                 weighted_data = coef * data[0]
-                feature_weights = sorted(
-                    zip(range(data.shape[1]), weighted_data),
-                    key=lambda x: np.abs(x[1]),
-                    reverse=True)
-                return np.array([x[0] for x in feature_weights[:num_features]])
+                return _top_abs_indices(weighted_data, num_features)
         elif method == 'lasso_path':
+            if sqrt_weights is None:
+                sqrt_weights = np.sqrt(weights)
+            weighted_labels = _weighted_center_scale(labels, weights, sqrt_weights)
             if not testing:
-                weighted_data = ((data - np.average(data, axis=0, weights=weights))
-                                 * np.sqrt(weights[:, np.newaxis]))
-                weighted_labels = ((labels - np.average(labels, weights=weights))
-                                   * np.sqrt(weights))
-
-                nonzero = range(weighted_data.shape[1])
+                if weighted_gram is None:
+                    weighted_gram = _weighted_gram(data, weights, sqrt_weights)
+                weighted_data, gram = weighted_gram
+                weighted_labels = weighted_labels.astype(gram.dtype, copy=False)
+                xy = np.dot(weighted_data.T, weighted_labels)
+                eps = np.finfo(gram.dtype).eps
+                # the full path is needed: after num_features steps lars can
+                # still drop one variable and add another, and the selection is
+                # the last step with at most num_features nonzeros
                 _, coefs = self.generate_lars_path(weighted_data,
-                                                   weighted_labels)
-                for i in range(len(coefs.T) - 1, 0, -1):
-                    nonzero = coefs.T[i].nonzero()[0]
-                    if len(nonzero) <= num_features:
-                        break
-                used_features = nonzero
-                return used_features
+                                                   weighted_labels,
+                                                   Gram=gram,
+                                                   Xy=xy,
+                                                   eps=eps)
+                return _lars_path_features(coefs, num_features)
             else:
-                weighted_data = ((data - np.average(data, axis=0, weights=weights))
-                                 * np.sqrt(weights[:, np.newaxis]))
-                weighted_labels = ((labels - np.average(labels, weights=weights))
-                                   * np.sqrt(weights))
+                # the hypothesis tests of the testing lars_path are computed
+                # from X itself, so it gets neither a precomputed Gram nor Xy
+                weighted_data = _weighted_center_scale(data, weights, sqrt_weights)
                 # Xscaler = sklearn.preprocessing.StandardScaler()
                 # Xscaler.fit(weighted_data)
                 # weighted_data = Xscaler.transform(weighted_data)
@@ -155,18 +341,16 @@ class LimeBase(object):
                 # Yscaler.fit(weighted_labels.reshape(-1, 1))
                 # weighted_labels = Yscaler.transform(weighted_labels.reshape(-1, 1)).ravel()
 
-                nonzero = range(weighted_data.shape[1])
                 alphas, coefs, test_result = self.generate_lars_path(weighted_data,
                                                                      weighted_labels, 
                                                                      testing=True,
                                                                      alpha=alpha)
-                for i in range(len(coefs.T) - 1, 0, -1):
-                    nonzero = coefs.T[i].nonzero()[0]
-                    if use_stratification:
-                        break
-                    if len(nonzero) <= num_features:
-                        break
-                used_features = nonzero
+                if use_stratification:
+                    # keep every feature at the end of the path, unstable
+                    # ones are eliminated afterwards
+                    used_features = _lars_path_features(coefs, coefs.shape[0])
+                else:
+                    used_features = _lars_path_features(coefs, num_features)
                 return used_features, test_result
         elif method == 'auto':
             if num_features <= 6:
@@ -174,7 +358,7 @@ class LimeBase(object):
             else:
                 n_method = 'highest_weights'
             return self.feature_selection(data, labels, weights,
-                                          num_features, n_method)
+                                          num_features, n_method, coef=coef)
 
     def explain_instance_with_data(self,
                                    neighborhood_data,
@@ -183,7 +367,9 @@ class LimeBase(object):
                                    label,
                                    num_features,
                                    feature_selection='auto',
-                                   model_regressor=None):
+                                   model_regressor=None,
+                                   coef=None,
+                                   weighted_gram=None):
         """Takes perturbed data, labels and distances, returns explanation.
 
         Args:
@@ -209,6 +395,11 @@ class LimeBase(object):
                 Defaults to Ridge regression if None. Must have
                 model_regressor.coef_ and 'sample_weight' as a parameter
                 to model_regressor.fit()
+            coef: optional precomputed coefficients of the weighted
+                Ridge(alpha=0.01) fit on all features, used by
+                'highest_weights' instead of fitting it again.
+            weighted_gram: optional precomputed (weighted_data, gram) of
+                neighborhood_data, used by 'lasso_path'.
 
         Returns:
             (intercept, exp, score, local_pred):
@@ -226,18 +417,19 @@ class LimeBase(object):
                                                labels_column,
                                                weights,
                                                num_features,
-                                               feature_selection)
+                                               feature_selection,
+                                               coef=coef,
+                                               weighted_gram=weighted_gram)
         if model_regressor is None:
             model_regressor = Ridge(alpha=1, fit_intercept=True,
                                     random_state=self.random_state)
         easy_model = model_regressor
-        easy_model.fit(neighborhood_data[:, used_features],
-                       labels_column, sample_weight=weights)
-        prediction_score = easy_model.score(
-            neighborhood_data[:, used_features],
-            labels_column, sample_weight=weights)
+        used_data = neighborhood_data[:, used_features]
+        easy_model.fit(used_data, labels_column, sample_weight=weights)
+        prediction_score = easy_model.score(used_data, labels_column,
+                                            sample_weight=weights)
 
-        local_pred = easy_model.predict(neighborhood_data[0, used_features].reshape(1, -1))
+        local_pred = easy_model.predict(used_data[0:1])
 
         if self.verbose:
             print('Intercept', easy_model.intercept_)
@@ -248,6 +440,63 @@ class LimeBase(object):
                        key=lambda x: np.abs(x[1]), reverse=True),
                 prediction_score, local_pred)
 
+    def explain_labels(self,
+                       neighborhood_data,
+                       neighborhood_labels,
+                       distances,
+                       labels,
+                       num_features,
+                       feature_selection='auto',
+                       model_regressor=None,
+                       n_jobs=1):
+        """Explains several labels of the same perturbed data in parallel.
+
+        Runs explain_instance_with_data once per label on a thread pool; the
+        heavy lifting happens in BLAS/LAPACK, which releases the GIL. Every
+        label gets its own clone of model_regressor. For 'highest_weights'
+        the Ridge fit on all features is done once for all labels, as a
+        single multi-target fit, and for 'lasso_path' the weighted data and
+        its Gram matrix are computed once and shared.
+
+        Args:
+            labels: iterable of labels for which we want an explanation
+            n_jobs: number of threads, as in joblib.Parallel. BLAS is often
+                multithreaded already, so more threads can oversubscribe.
+            See explain_instance_with_data for the other arguments.
+
+        Returns:
+            list with the output of explain_instance_with_data for each label,
+            in the order of labels.
+        """
+        labels = list(labels)
+        # converted once here; the per-label calls then get a Fortran array
+        # and do not copy it again
+        neighborhood_data = _as_fortran(neighborhood_data)
+        weights = self.kernel_fn(distances)
+        method = feature_selection
+        if method == 'auto':
+            method = 'forward_selection' if num_features <= 6 else 'highest_weights'
+        coefs = [None] * len(labels)
+        weighted_gram = None
+        if method == 'lasso_path':
+            weighted_gram = _weighted_gram(neighborhood_data, weights)
+        elif method == 'highest_weights' and labels:
+            clf = Ridge(alpha=0.01, fit_intercept=True,
+                        random_state=self.random_state)
+            clf.fit(neighborhood_data, neighborhood_labels[:, labels],
+                    sample_weight=weights)
+            coefs = clf.coef_
+        jobs = (delayed(self.explain_instance_with_data)(
+                    neighborhood_data, neighborhood_labels, distances, label,
+                    num_features,
+                    feature_selection=feature_selection,
+                    model_regressor=(None if model_regressor is None
+                                     else clone(model_regressor, safe=False)),
+                    coef=coef,
+                    weighted_gram=weighted_gram)
+                for label, coef in zip(labels, coefs))
+        return Parallel(n_jobs=n_jobs, prefer='threads')(jobs)
+
     def testing_explain_instance_with_data(self,
                                    neighborhood_data,
                                    neighborhood_labels,
@@ -297,8 +546,9 @@ class LimeBase(object):
             local_pred is the prediction of the explanation model on the original instance
         """
         if weight_adjustments is not None:
-            distances *= weight_adjustments
-        weights = self.kernel_fn(distances)
+            distances = distances * weight_adjustments
+        weights = np.asarray(self.kernel_fn(distances), dtype=np.float64)
+        sqrt_weights = np.sqrt(weights)
         labels_column = neighborhood_labels[:, label]
         if model_regressor is None:
             model_regressor = Ridge(alpha=1, fit_intercept=True,
@@ -314,20 +564,23 @@ class LimeBase(object):
                                                                     feature_selection,
                                                                     testing=True,
                                                                     alpha=alpha,
-                                                                    use_stratification=use_stratification)
+                                                                    use_stratification=use_stratification,
+                                                                    sqrt_weights=sqrt_weights)
         #print("used_features 1:")
         #print(len(used_features))
-        used_features = list(set(used_features)-set(elimination))
+        eliminated = np.zeros(neighborhood_data.shape[1], dtype=bool)
+        eliminated[elimination] = True
+        used_features = np.asarray(used_features, dtype=np.intp)
+        used_features = used_features[~eliminated[used_features]]
         #print("used_features 2:")
         #print(len(used_features))
         easy_model = model_regressor
-        easy_model.fit(neighborhood_data[:, used_features],
-                       labels_column, sample_weight=weights)
-        prediction_score = easy_model.score(
-            neighborhood_data[:, used_features],
-            labels_column, sample_weight=weights)
+        used_data = neighborhood_data[:, used_features]
+        easy_model.fit(used_data, labels_column, sample_weight=weights)
+        prediction_score = easy_model.score(used_data, labels_column,
+                                            sample_weight=weights)
 
-        local_pred = easy_model.predict(neighborhood_data[0, used_features].reshape(1, -1))
+        local_pred = easy_model.predict(used_data[0:1])
 
         if self.verbose:
             print('Intercept', easy_model.intercept_)
@@ -339,35 +592,30 @@ class LimeBase(object):
                 prediction_score, local_pred, used_features, test_result)
 
     def fit_ridge_on_k_neighbors(self, neighborhood_data, labels_column):
-        n_samples = neighborhood_data.shape[0]
-        coefs = np.zeros((n_samples, neighborhood_data.shape[1]))
+        n_samples, n_features = neighborhood_data.shape
+        # only the signs of the bootstrap coefficients are used, so single
+        # precision is enough and halves the memory traffic of the fits.
+        # Ridge with intercept is shift invariant, so center in float64 first:
+        # large feature offsets would otherwise cancel catastrophically in the
+        # float32 bootstrap Gram matrices.
+        data32 = (neighborhood_data - neighborhood_data.mean(axis=0)).astype(np.float32)
+        labels32 = (labels_column - labels_column.mean()).astype(np.float32)
         iter = 0
-        flags = np.ones(neighborhood_data.shape[1], dtype = bool)
+        flags = np.ones(n_features, dtype = bool)
         elimination = []
         while iter < 5:
-            feats = [i for i in range(neighborhood_data.shape[1]) if flags[i]]
-            coefs = np.zeros((n_samples, len(feats)), dtype=float)
-            for i in range(n_samples):
-                model_regressor = Ridge(alpha=1, fit_intercept=True, random_state=self.random_state)
-                boots_sample_idx = np.random.choice(list(range(n_samples)), size = n_samples, replace = True)
-                # Dữ liệu lân cận
-                X_neighbors = neighborhood_data[boots_sample_idx]
-                X_neighbors = X_neighbors[:,feats]
-                y_neighbors = labels_column[boots_sample_idx]
-                # Huấn luyện Ridge với k mẫu lân cận
-                model_regressor.fit(X_neighbors, y_neighbors)
-                # Lưu hệ số hồi quy cho mẫu thứ i
-                coefs[i, :] = model_regressor.coef_
-            idx = 0
-            for i in feats:
-                signs = np.sign(coefs[:,idx])
-                unique, counts = np.unique(signs, return_counts=True)
-                probabilities = counts / len(signs)
-                sign_entropy = entropy(probabilities, base=2)     #log2(prob)
-                if sign_entropy > 0.85:      #set threshold to eliminate unstable features
-                    elimination.append(feats[idx])
-                    flags[feats[idx]] = 0
-                idx += 1
+            feats = np.flatnonzero(flags)
+            coefs = _bootstrap_ridge_coefs(data32[:, feats], labels32,
+                                           n_samples, alpha=1.,
+                                           random_state=self.random_state)
+            sign_entropy = _sign_entropy(coefs)
+            unstable = feats[sign_entropy > 0.85]      #set threshold to eliminate unstable features
+            elimination.extend(unstable.tolist())
+            flags[unstable] = False
             iter = iter + 1
+            # another round can only differ by bootstrap noise once nothing
+            # was eliminated, and there is nothing left to test without features
+            if len(unstable) == 0 or not flags.any():
+                break
         return elimination
 
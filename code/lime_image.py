@@ -135,7 +135,8 @@ class LimeImageExplainer(object):
                          distance_metric='cosine',
                          model_regressor=None,
                          random_seed=None,
-                         progress_bar=True):
+                         progress_bar=True,
+                         n_jobs=1):
         """Generates explanations for a prediction.
 
         First, we generate neighborhood data by randomly perturbing features
@@ -167,6 +168,8 @@ class LimeImageExplainer(object):
                 algorithm. If None, a random integer, between 0 and 1000,
                 will be generated using the internal random number generator.
             progress_bar: if True, show tqdm progress bar.
+            n_jobs: number of threads used to explain the labels in parallel
+                (see LimeBase.explain_labels).
 
         Returns:
             An ImageExplanation object (see lime_image.py) with the corresponding
@@ -214,14 +217,16 @@ class LimeImageExplainer(object):
             top = np.argsort(labels[0])[-top_labels:]
             ret_exp.top_labels = list(top)
             ret_exp.top_labels.reverse()
-        for label in top:
+        explanations = self.base.explain_labels(
+            data, labels, distances, top, num_features,
+            model_regressor=model_regressor,
+            feature_selection=self.feature_selection,
+            n_jobs=n_jobs)
+        for label, explanation in zip(top, explanations):
             (ret_exp.intercept[label],
              ret_exp.local_exp[label],
              ret_exp.score[label],
-             ret_exp.local_pred[label]) = self.base.explain_instance_with_data(
-                data, labels, distances, label, num_features,
-                model_regressor=model_regressor,
-                feature_selection=self.feature_selection)
+             ret_exp.local_pred[label]) = explanation
         return ret_exp
 
     def testing_explain_instance(self, image, classifier_fn, labels=(1,),